@@ -4,19 +4,117 @@ v7: Diagnostic build — echo handler first to verify RunPod queue connectivity,
 then model loading + full generation if echo works.
 
 Two-phase startup:
-  Phase 1: Register handler immediately (proves queue works)
-  Phase 2: Load model on first real job (not echo/ping)
+  Phase 1: Import torch + ACE-Step (bytecode pre-compiled into the image),
+           then register the handler (proves queue works); an ACE-Step
+           import failure is reported per job instead of crashing the worker
+  Phase 2: Load model in a background thread; the first real job waits on
+           the in-progress load instead of starting its own
 """
 
-import base64
+import asyncio
+import binascii
+import collections
+import fcntl
+import functools
+import glob
+import hashlib
+import io
+import json
+import logging
+import mmap
 import os
+import pickle
+import queue
+import shutil
+import stat
+import subprocess
 import sys
 import tempfile
+import threading
 import time
-import traceback
+import uuid
+from dataclasses import dataclass, field
 
+import pybase64
 import runpod
 
+# Stream-ordered allocator: must be configured before torch initialises CUDA.
+# PyTorch's cudaMallocAsync backend raises the device mempool's release
+# threshold to UINT64_MAX itself, so freed blocks stay reserved across jobs.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "backend:cudaMallocAsync")
+
+# Heavy imports at module level: they resolve from the bytecode cache that
+# prewarm.py bakes into the image, instead of landing on the first job.
+import soundfile as sf  # noqa: E402
+import torch  # noqa: E402
+
+try:
+    from acestep.handler import AceStepHandler
+    from acestep.inference import GenerationParams, GenerationConfig, generate_music
+    from acestep.llm_inference import LLMHandler
+    _import_error = None
+except Exception as ie:
+    # Any import failure (not just ImportError) keeps the worker up so it is
+    # reported through the API
+    _import_error = f"ACE-Step import failed: {ie}"
+
+# ──────────────────────────────────────────────────────────
+# Error logging — one JSON line per failure, rate limited
+# ──────────────────────────────────────────────────────────
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {"ts": record.created, "level": record.levelname,
+                   "msg": record.getMessage()}
+        for key in ("job_id", "phase", "suppressed"):
+            if hasattr(record, key):
+                payload[key] = getattr(record, key)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload)
+
+
+class _RateLimitFilter(logging.Filter):
+    """Pass at most `calls` records per `period` seconds.
+
+    Attached to the logger rather than the handler, so dropped records are
+    never formatted. The first record of each new window carries the number
+    suppressed in the previous one.
+    """
+
+    def __init__(self, calls, period):
+        super().__init__()
+        self.calls = calls
+        self.period = period
+        self._window_start = 0.0
+        self._count = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.period:
+                if self._dropped:
+                    record.suppressed = self._dropped
+                self._window_start = now
+                self._count = 0
+                self._dropped = 0
+            self._count += 1
+            if self._count > self.calls:
+                self._dropped += 1
+                return False
+            return True
+
+
+logger = logging.getLogger("sophia")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addFilter(_RateLimitFilter(calls=10, period=60))
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(_JsonFormatter())
+logger.addHandler(_log_handler)
+
 # ──────────────────────────────────────────────────────────
 # Global state
 # ──────────────────────────────────────────────────────────
@@ -26,19 +124,347 @@ _llm_handler = None
 _model_loaded = False
 _model_error = None  # Store error details for API response
 _model_config = os.environ.get("ACESTEP_MODEL", "acestep-v15-turbo")
+_acestep_root = os.environ.get("ACESTEP_ROOT", "/app/acestep")
+_inference_dtype = None  # torch dtype chosen at load time
+# Opt-in: every new duration compiles (and captures) a fresh graph, which
+# the first job at that shape pays for
+_compile_model = os.environ.get("SOPHIA_COMPILE", "0") == "1"
+_cudnn_benchmark = os.environ.get("SOPHIA_CUDNN_BENCHMARK", "0") == "1"
+_load_lock = threading.Lock()  # serialises background preload vs first job
+
+# Idle VRAM release: DiT weights move to pinned host memory after
+# SOPHIA_KEEP_ALIVE seconds without a job (0 disables)
+_keep_alive = int(os.environ.get("SOPHIA_KEEP_ALIVE", "300"))
+_gpu_lock = threading.Lock()  # held for inference and offload/reload
+_last_job_ts = time.time()
+_offloaded = False
+
+# Elastic pool: cached-but-free VRAM is returned once the worker has been
+# idle longer than the p95 of recent inter-arrival gaps (never under 60s)
+_trim_min_idle = 60
+_job_history = collections.deque(maxlen=64)  # job completion timestamps
+_pool_trimmed = False
+
+# ──────────────────────────────────────────────────────────
+# Object storage — optional presigned-URL output (S3 / R2)
+# ──────────────────────────────────────────────────────────
+
+_s3_bucket = os.environ.get("S3_BUCKET", "")
+_s3_url_expiry = int(os.environ.get("S3_URL_EXPIRY", "3600"))
+_inline_max_bytes = int(os.environ.get("SOPHIA_INLINE_MAX_BYTES", str(1024 * 1024)))
+_s3 = None
+
+if _s3_bucket:
+    import boto3
+
+    # Credentials come from the standard AWS_* env vars
+    _s3 = boto3.client("s3", endpoint_url=os.environ.get("S3_ENDPOINT") or None)
+
+
+def _upload_output(wav_bytes, job_id):
+    """Upload generated WAV bytes to the bucket and return a presigned GET URL."""
+    key = f"sophia/{job_id or uuid.uuid4().hex}.wav"
+    _s3.put_object(Bucket=_s3_bucket, Key=key, Body=wav_bytes,
+                   ContentType="audio/wav")
+    return _s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": _s3_bucket, "Key": key},
+        ExpiresIn=_s3_url_expiry,
+    )
+
+
+# ──────────────────────────────────────────────────────────
+# Local NVMe weight cache
+# ──────────────────────────────────────────────────────────
+
+_weight_cache_dir = os.environ.get("SOPHIA_WEIGHT_CACHE", "/mnt/nvme/sophia-cache")
+_weight_cache_min_free = 0.20  # evict LRU entries below 20% free space
+_warmup_lock = threading.Lock()
+_warmup_started = False
+_staging_done = threading.Event()  # _weight_root is final (staged or not)
+_weight_root = _acestep_root  # project root ACE-Step loads from
+
+
+def _weight_files(acestep_root):
+    """All safetensors weight files under the ACE-Step checkout."""
+    pattern = os.path.join(acestep_root, "**", "*.safetensors")
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def _lock_entry(entry, flags):
+    """flock an entry's lock file; returns the fd, or None if it would block.
+
+    Retries if the entry was evicted (lock file unlinked) while we waited,
+    so a lock is never held on a deleted inode. Shared locks are held for
+    the process lifetime to mark an entry in use; eviction needs LOCK_EX.
+    """
+    lock_path = os.path.join(entry, ".lock")
+    while True:
+        os.makedirs(entry, exist_ok=True)
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+_weight_cache_locks = []  # shared entry locks held while this process uses them
+
+
+def _evict_weight_cache(cache_root, incoming, keep):
+    """Drop least-recently-used cache entries until `incoming` bytes fit.
+
+    Entries locked by any process (this container or another on the same
+    volume) are skipped.
+    """
+    entries = sorted(
+        (os.path.getmtime(path), path)
+        for path in glob.glob(os.path.join(cache_root, "*"))
+        if path not in keep
+    )
+    for _, path in entries:
+        usage = shutil.disk_usage(cache_root)
+        if (usage.free - incoming) / usage.total >= _weight_cache_min_free:
+            return
+        fd = _lock_entry(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if fd is None:
+            continue  # in use elsewhere
+        try:
+            print(f"[SOPHIA]   evicting cached weights: {path}", flush=True)
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            os.close(fd)
+
+
+def _weight_cache_entry(acestep_root, src):
+    """(entry dir, cached file path) for a source weight file.
+
+    Entries are keyed by a sha256 prefix of (relative path, size, mtime), so a
+    revived container of the same image reuses them without copying.
+    """
+    st = os.stat(src)
+    ident = f"{os.path.relpath(src, acestep_root)}:{st.st_size}:{st.st_mtime_ns}"
+    entry = os.path.join(_weight_cache_dir, hashlib.sha256(ident.encode()).hexdigest()[:16])
+    return entry, os.path.join(entry, os.path.basename(src))
+
+
+def _build_weight_root(acestep_root, cached):
+    """Mirror `acestep_root` in a private temp dir, with `cached` files swapped.
+
+    `cached` maps original weight paths to their NVMe copies. Directories on
+    the way to a cached file are recreated; every other entry is a symlink
+    back to the original, so the checkout itself is never modified and a
+    restarted process never sees a link into an evicted entry.
+    """
+    root = tempfile.mkdtemp(prefix="sophia-root-")
+    rel_cached = {os.path.relpath(src, acestep_root): dst for src, dst in cached.items()}
+    mirrored = {os.path.dirname(rel) for rel in rel_cached}
+    for rel in list(mirrored):
+        while rel:
+            rel = os.path.dirname(rel)
+            mirrored.add(rel)
+    for rel_dir in sorted(mirrored):
+        os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+        for name in os.listdir(os.path.join(acestep_root, rel_dir)):
+            rel = os.path.normpath(os.path.join(rel_dir, name))
+            if rel in mirrored:
+                continue
+            os.symlink(rel_cached.get(rel, os.path.join(acestep_root, rel)),
+                       os.path.join(root, rel))
+    return root
+
+
+def _stage_weights(acestep_root):
+    """Serve weight files that are already in the NVMe cache.
+
+    Fast path only — no copying, so the model load never waits on a copy.
+    Each hit's entry stays share-locked for the process lifetime so no
+    other process evicts it. Returns (project root to load from, missing),
+    where `missing` lists sources for _fill_weight_cache. No-op when the
+    cache volume is not mounted.
+    """
+    if not os.path.isdir(os.path.dirname(_weight_cache_dir)):
+        return acestep_root, []
+    os.makedirs(_weight_cache_dir, exist_ok=True)
+
+    cached = {}
+    missing = []
+    for src in _weight_files(acestep_root):
+        entry, dst = _weight_cache_entry(acestep_root, src)
+        fd = _lock_entry(entry, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        if fd is None or not os.path.exists(dst):
+            # Absent, or another process is still writing it
+            if fd is not None:
+                os.close(fd)
+            missing.append(src)
+            continue
+        os.utime(entry)  # LRU touch
+        _weight_cache_locks.append(fd)
+        cached[src] = dst
+    if not cached:
+        return acestep_root, missing
+    return _build_weight_root(acestep_root, cached), missing
+
+
+def _fill_weight_cache(acestep_root, missing):
+    """Copy cache misses to NVMe for the next container.
+
+    Runs after the model has started loading from the originals. Each entry
+    is written under an exclusive flock to a unique mkstemp name, so
+    concurrent workers never clobber each other's partial copies.
+    """
+    keep = {_weight_cache_entry(acestep_root, src)[0] for src in missing}
+    filled = 0
+    for src in missing:
+        entry, dst = _weight_cache_entry(acestep_root, src)
+        fd = _lock_entry(entry, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(dst):
+                continue  # another worker finished it while we waited
+            _evict_weight_cache(_weight_cache_dir, os.path.getsize(src), keep)
+            tmp_fd, partial = tempfile.mkstemp(dir=entry, suffix=".partial")
+            try:
+                with open(src, "rb") as fin, os.fdopen(tmp_fd, "wb") as fout:
+                    shutil.copyfileobj(fin, fout, length=16 * 1024 * 1024)
+                os.chmod(partial, 0o644)  # mkstemp creates 0600
+                os.replace(partial, dst)
+            except BaseException:
+                os.unlink(partial)
+                raise
+            filled += 1
+        finally:
+            os.close(fd)
+    return filled
+
+
+def _prefetch_weights(paths):
+    """Fault weight files into the page cache ahead of the model load.
+
+    mmap(MAP_POPULATE) reads each file in one pass, instead of safetensors
+    taking a page fault per tensor on a cold cache. Runs on the warm-up
+    thread after staging, overlapping registration and ACE-Step module
+    construction.
+    """
+    start = time.time()
+    total = 0
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                size = os.fstat(fd).st_size
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+                if size and hasattr(mmap, "MAP_POPULATE"):
+                    mmap.mmap(fd, size, flags=mmap.MAP_PRIVATE | mmap.MAP_POPULATE,
+                              prot=mmap.PROT_READ).close()
+                total += size
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"[SOPHIA]   prefetch failed for {path}: {e}", flush=True)
+    print(f"[SOPHIA]   prefetched {total / 1e9:.1f}GB of weights "
+          f"in {time.time() - start:.1f}s", flush=True)
+
+
+def _stage_and_prefetch():
+    """Stage weights into the NVMe cache, then prefetch what the model will read.
+
+    Cache hits are linked before prefetching, so the page cache is filled
+    from the NVMe copies rather than the slow originals. Misses load from
+    the originals and are copied into the cache afterwards.
+    """
+    global _weight_root
+    missing = []
+    try:
+        _weight_root, missing = _stage_weights(_acestep_root)
+        if _weight_root != _acestep_root:
+            print(f"[SOPHIA]   weights served from {_weight_cache_dir} via {_weight_root} "
+                  f"({len(missing)} misses)", flush=True)
+    except Exception as se:
+        # Cache is an optimisation only — fall back to loading in place
+        print(f"[SOPHIA]   weight staging skipped: {se}", flush=True)
+        _weight_root = _acestep_root
+    finally:
+        _staging_done.set()
+
+    _prefetch_weights([
+        os.path.realpath(os.path.join(_weight_root, os.path.relpath(p, _acestep_root)))
+        for p in _weight_files(_acestep_root)
+    ])
+
+    # Misses are copied off the load path; the source is page-cache hot now
+    if missing:
+        start = time.time()
+        try:
+            filled = _fill_weight_cache(_acestep_root, missing)
+            if filled:
+                print(f"[SOPHIA]   cached {filled} weight files to {_weight_cache_dir} "
+                      f"in {time.time() - start:.1f}s", flush=True)
+        except Exception as fe:
+            print(f"[SOPHIA]   weight cache fill failed: {fe}", flush=True)
+
+
+def _start_weight_warmup():
+    """Start _stage_and_prefetch once per process."""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_stage_and_prefetch, name="sophia-warmup", daemon=True).start()
+
+
+_DTYPE_ALIASES = {
+    "bf16": "bf16", "bfloat16": "bf16",
+    "fp16": "fp16", "float16": "fp16", "half": "fp16",
+    "fp32": "fp32", "float32": "fp32", "float": "fp32",
+}
+
+
+def _select_dtype():
+    """Resolve SOPHIA_DTYPE (bf16 | fp16 | fp32) against the current GPU.
+
+    bf16 falls back to fp16 on pre-Ampere cards without bf16 support.
+    Unrecognised values are logged and treated as the bf16 default.
+    """
+    raw = os.environ.get("SOPHIA_DTYPE", "bf16")
+    choice = _DTYPE_ALIASES.get(raw.strip().lower())
+    if choice is None:
+        print(f"[SOPHIA]   unknown SOPHIA_DTYPE={raw!r}, using bf16", flush=True)
+        choice = "bf16"
+    if choice == "fp32":
+        return torch.float32
+    if choice == "fp16":
+        return torch.float16
+    if torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    print("[SOPHIA]   bf16 unsupported on this GPU, using fp16", flush=True)
+    return torch.float16
 
 
 def _load_model():
-    """Load model onto GPU. Called once on first real job.
+    """Load model onto GPU. Safe to call from several threads.
 
-    Returns (True, None) on success or (False, error_string) on failure.
+    A caller that arrives during an in-progress load blocks until it finishes
+    and then returns immediately. Returns (True, None) on success or
+    (False, error_string) on failure.
     """
-    global _dit_handler, _llm_handler, _model_loaded, _model_error
+    with _load_lock:
+        if _model_loaded:
+            return True, None
+        return _load_model_locked()
 
-    if _model_loaded:
-        return True, None
 
-    acestep_root = os.environ.get("ACESTEP_ROOT", "/app/acestep")
+def _load_model_locked():
+    global _dit_handler, _llm_handler, _model_loaded, _model_error, _inference_dtype
+
+    acestep_root = _acestep_root
 
     print("[SOPHIA] ════════════════════════════════════════", flush=True)
     print("[SOPHIA] Loading ACE-Step 1.5 model...", flush=True)
@@ -48,12 +474,12 @@ def _load_model():
 
     # Check CUDA availability
     try:
-        import torch
         print(f"[SOPHIA]   torch:  {torch.__version__}", flush=True)
         print(f"[SOPHIA]   cuda:   {torch.cuda.is_available()}", flush=True)
         if torch.cuda.is_available():
             print(f"[SOPHIA]   gpu:    {torch.cuda.get_device_name(0)}", flush=True)
             print(f"[SOPHIA]   vram:   {torch.cuda.get_device_properties(0).total_mem / 1e9:.1f}GB", flush=True)
+            print(f"[SOPHIA]   alloc:  {torch.cuda.get_allocator_backend()}", flush=True)
     except Exception as te:
         print(f"[SOPHIA]   torch check failed: {te}", flush=True)
 
@@ -66,22 +492,47 @@ def _load_model():
         _model_error = msg
         return False, msg
 
+    if _import_error:
+        print(f"[SOPHIA]   ERROR: {_import_error}", flush=True)
+        _model_error = _import_error
+        return False, _import_error
+
     start = time.time()
 
-    try:
-        from acestep.handler import AceStepHandler
-        from acestep.llm_inference import LLMHandler
+    # The project root (original, or a mirror pointing at cached copies) must
+    # be final before ACE-Step opens weights; prefetching continues behind it
+    _start_weight_warmup()
+    _staging_done.wait()
 
+    try:
         print("[SOPHIA] Creating AceStepHandler...", flush=True)
         _dit_handler = AceStepHandler()
 
+        if _compile_model and torch.cuda.get_allocator_backend() == "cudaMallocAsync":
+            # Graph trees need allocator checkpointing, which cudaMallocAsync lacks
+            print("[SOPHIA]   cudagraphs: skipped under cudaMallocAsync — set "
+                  "PYTORCH_CUDA_ALLOC_CONF=backend:native to capture", flush=True)
+        elif _compile_model:
+            import torch._inductor.config as inductor_config
+
+            # CUDA graph trees: each compiled DiT step replays one captured
+            # graph instead of re-launching every kernel, and all captured
+            # shapes share a single per-device memory pool.
+            inductor_config.triton.cudagraphs = True
+
+        # TF32 tensor cores for any remaining fp32 matmuls/convs. cuDNN
+        # autotuning is opt-in: it re-runs for every new duration's shapes
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = _cudnn_benchmark
+
         print("[SOPHIA] Calling initialize_service...", flush=True)
         status_msg, success = _dit_handler.initialize_service(
-            project_root=acestep_root,
+            project_root=_weight_root,
             config_path=_model_config,
             device="cuda",
             use_flash_attention=False,
-            compile_model=False,
+            compile_model=_compile_model,
             offload_to_cpu=False,
             offload_dit_to_cpu=False,
         )
@@ -95,6 +546,21 @@ def _load_model():
             _model_error = msg
             return False, msg
 
+        # ── Reduced-precision DiT weights ──
+        _inference_dtype = _select_dtype()
+        model = getattr(_dit_handler, "model", None)
+        if model is not None and _inference_dtype != torch.float32:
+            model.to(_inference_dtype)
+            if hasattr(_dit_handler, "dtype"):
+                _dit_handler.dtype = _inference_dtype
+        print(f"[SOPHIA]   dtype:  {_inference_dtype}", flush=True)
+
+        if _share_weights:
+            try:
+                _share_dit_weights()
+            except Exception as we:
+                print(f"[SOPHIA]   weight sharing disabled: {we}", flush=True)
+
         _llm_handler = LLMHandler()
         _model_loaded = True
 
@@ -105,18 +571,571 @@ def _load_model():
 
     except Exception as e:
         msg = f"Model load exception: {str(e)}"
-        print(f"[SOPHIA] {msg}", flush=True)
-        traceback.print_exc()
+        logger.error(msg, exc_info=True, extra={"phase": "load"})
         _model_error = msg
         return False, msg
 
 
+# ──────────────────────────────────────────────────────────
+# Cross-process weight sharing — one DiT copy per GPU via CUDA IPC
+# ──────────────────────────────────────────────────────────
+
+_share_weights = os.environ.get("SOPHIA_SHARE_WEIGHTS", "0") == "1"
+_share_dir = f"/dev/shm/sophia-ipc-{os.getuid()}"  # mode 0700, verified before use
+_leader_lock_path = os.path.join(_share_dir, "leader.lock")
+_handles_path = os.path.join(_share_dir, "handles.pkl")
+_leader_fd = None  # flock held for the leader's lifetime
+_attach_pending = False  # follower still running on its own copy
+_leader_pid = None  # leader whose allocations this follower maps
+
+
+def _dit_named_tensors():
+    model = getattr(_dit_handler, "model", None)
+    if model is None:
+        return {}
+    return {**dict(model.named_parameters()), **dict(model.named_buffers())}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _ensure_share_dir():
+    """Create the IPC dir and refuse it unless only this user can write it.
+
+    The handles file is unpickled, so it must not be replaceable by anyone
+    else sharing /dev/shm.
+    """
+    os.makedirs(_share_dir, mode=0o700, exist_ok=True)
+    st = os.lstat(_share_dir)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or st.st_mode & 0o077):
+        raise PermissionError(f"insecure weight-sharing dir: {_share_dir}")
+
+
+def _share_dit_weights():
+    """Publish or attach to a single GPU copy of the DiT weights.
+
+    The first handler process to take the leader lock publishes CUDA IPC
+    handles for every parameter and buffer; later processes map those
+    allocations and free their own copy. A follower never waits here: if
+    the leader has not published yet it keeps its own weights and the idle
+    watcher retries. Idle offload is disabled in both roles — moving the
+    leader's weights would pull them out from under every follower.
+
+    If the leader exits, followers' mappings point at freed memory. The
+    handler checks the leader is alive before each job and reloads when it
+    is not; a job already running when the leader dies will fail.
+    """
+    global _leader_fd, _keep_alive, _attach_pending
+    from torch.multiprocessing.reductions import reduce_tensor
+
+    if torch.cuda.get_allocator_backend() == "cudaMallocAsync":
+        # Allocations from the async pool cannot be exported as IPC handles
+        raise RuntimeError("CUDA IPC is not supported under cudaMallocAsync; "
+                           "set PYTORCH_CUDA_ALLOC_CONF=backend:native")
+    _ensure_share_dir()
+
+    fd = os.open(_leader_lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        _keep_alive = 0
+        _attach_pending = True
+        if not _try_attach_shared_weights():
+            print("[SOPHIA] Weight-sharing leader not ready — using local weights "
+                  "until it publishes", flush=True)
+        return
+
+    try:
+        handles = {name: reduce_tensor(t.data) for name, t in _dit_named_tensors().items()}
+        tmp_fd, partial = tempfile.mkstemp(dir=_share_dir, suffix=".partial")  # 0600
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                pickle.dump({"pid": os.getpid(), "tensors": handles}, f)
+            os.replace(partial, _handles_path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+    except BaseException:
+        os.close(fd)  # releases the flock so another process can lead
+        raise
+    _leader_fd = fd
+    _keep_alive = 0
+    print(f"[SOPHIA] Weight-sharing leader: published {len(handles)} tensors", flush=True)
+
+
+def _try_attach_shared_weights():
+    """Follower: swap local DiT tensors for a live leader's allocations.
+
+    Single non-blocking attempt. Caller must not be generating (hold
+    _gpu_lock or _load_lock). Returns True once attached.
+    """
+    global _attach_pending, _leader_pid
+
+    try:
+        with open(_handles_path, "rb") as f:
+            published = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False
+    pid = published["pid"]
+    if pid == os.getpid() or not _pid_alive(pid):
+        return False
+
+    # Both processes address the same device inside the container, so the
+    # rebuilt tensors open on the consumer's own context
+    named = _dit_named_tensors()
+    attached = 0
+    for name, t in named.items():
+        entry = published["tensors"].get(name)
+        if entry is None:
+            continue
+        rebuild, args = entry
+        shared = rebuild(*args)
+        if shared.shape == t.shape and shared.dtype == t.dtype:
+            t.data = shared
+            attached += 1
+    torch.cuda.empty_cache()
+    _attach_pending = False
+    _leader_pid = pid
+    print(f"[SOPHIA] Weight-sharing follower: attached {attached}/{len(named)} tensors "
+          f"from pid {pid}", flush=True)
+    return True
+
+
+def _drop_orphaned_weights():
+    """Follower: if the leader has exited, discard the model so it reloads.
+
+    Returns True when the model was dropped.
+    """
+    global _dit_handler, _model_loaded, _leader_pid
+    with _gpu_lock:
+        if _leader_pid is None or _pid_alive(_leader_pid):
+            return False
+        print(f"[SOPHIA] Weight-sharing leader {_leader_pid} exited — reloading model",
+              flush=True)
+        _model_loaded = False
+        _dit_handler = None
+        _leader_pid = None
+        torch.cuda.empty_cache()
+        return True
+
+
+# ──────────────────────────────────────────────────────────
+# Idle offload — release VRAM between bursts of jobs
+# ──────────────────────────────────────────────────────────
+
+def _dit_tensors():
+    return list(_dit_named_tensors().values())
+
+
+def _offload_dit():
+    """Move DiT weights to pinned host memory and free their VRAM.
+
+    Caller must hold _gpu_lock.
+    """
+    global _offloaded, _pool_trimmed
+
+    start = time.time()
+    # Flag first: if the loop fails partway (e.g. pinned-memory OOM) the
+    # next job still runs _reload_dit and gathers every tensor back
+    _offloaded = True
+    for t in _dit_tensors():
+        host = torch.empty_like(t.data, device="cpu", pin_memory=True)
+        host.copy_(t.data, non_blocking=True)
+        t.data = host
+    torch.cuda.synchronize()
+    torch.cuda.empty_cache()
+    _pool_trimmed = True
+    print(f"[SOPHIA] Idle for {_keep_alive}s — DiT offloaded to host "
+          f"in {time.time() - start:.1f}s", flush=True)
+
+
+def _reload_dit():
+    """Copy any off-GPU DiT weights back to VRAM. Caller must hold _gpu_lock."""
+    global _offloaded
+
+    start = time.time()
+    for t in _dit_tensors():
+        if t.device.type != "cuda":
+            t.data = t.data.to("cuda", non_blocking=True)
+    torch.cuda.synchronize()
+    _offloaded = False
+    print(f"[SOPHIA] DiT reloaded to GPU in {time.time() - start:.1f}s", flush=True)
+
+
+def _trim_threshold():
+    """Idle seconds after which the allocator pool is trimmed.
+
+    Bursty traffic (short gaps) keeps the pool primed; sparse traffic
+    trims after the 95th-percentile gap has passed without a new job.
+    """
+    stamps = list(_job_history)
+    gaps = sorted(b - a for a, b in zip(stamps, stamps[1:]))
+    if not gaps:
+        return _trim_min_idle
+    p95 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))]
+    return max(_trim_min_idle, p95)
+
+
+def _trim_pool():
+    """Release cached-but-unused VRAM. Caller must hold _gpu_lock."""
+    global _pool_trimmed
+
+    before = torch.cuda.memory_reserved()
+    torch.cuda.empty_cache()
+    _pool_trimmed = True
+    print(f"[SOPHIA] Allocator pool trimmed: {before / 1e9:.2f}GB -> "
+          f"{torch.cuda.memory_reserved() / 1e9:.2f}GB reserved", flush=True)
+
+
+def _idle_watcher():
+    """Trim the allocator pool, then offload the DiT, as idle time grows."""
+    while True:
+        time.sleep(10)
+        if not _model_loaded:
+            continue
+        if _attach_pending and _gpu_lock.acquire(blocking=False):
+            try:
+                _try_attach_shared_weights()
+            except Exception as e:
+                print(f"[SOPHIA] Weight-sharing attach failed: {e}", flush=True)
+            finally:
+                _gpu_lock.release()
+        if _offloaded:
+            continue
+        idle = time.time() - _last_job_ts
+        if _keep_alive > 0 and idle >= _keep_alive:
+            action = _offload_dit
+        elif not _pool_trimmed and idle >= _trim_threshold():
+            action = _trim_pool
+        else:
+            continue
+        if not _gpu_lock.acquire(blocking=False):
+            continue  # a job is running
+        try:
+            action()
+        except Exception as e:
+            print(f"[SOPHIA] Idle {action.__name__} failed: {e}", flush=True)
+        finally:
+            _gpu_lock.release()
+
+
+# ──────────────────────────────────────────────────────────
+# Scratch files — per-job, tmpfs when available
+# ──────────────────────────────────────────────────────────
+
+def _select_scratch_dir():
+    shm = "/dev/shm/sophia"
+    try:
+        os.makedirs(shm, exist_ok=True)
+        return shm
+    except OSError:
+        return tempfile.gettempdir()
+
+
+_scratch_dir = _select_scratch_dir()
+
+
+def _write_reference(reference_audio_b64):
+    """Decode reference audio into a uniquely named temp file; return its path.
+
+    Falls back to the disk temp dir when tmpfs is full (Docker's default
+    /dev/shm is only 64 MB).
+    """
+    data = memoryview(pybase64.b64decode(reference_audio_b64, validate=False))
+    for directory in dict.fromkeys((_scratch_dir, tempfile.gettempdir())):
+        fd, path = tempfile.mkstemp(prefix="sophia_ref_", suffix=".wav", dir=directory)
+        try:
+            # Raw fd writes: no userspace buffer copy, no flush round-trip
+            remaining = data
+            while remaining:
+                remaining = remaining[os.write(fd, remaining):]
+            return path
+        except OSError:
+            os.unlink(path)
+            if directory == tempfile.gettempdir():
+                raise
+        finally:
+            os.close(fd)
+
+
+# ──────────────────────────────────────────────────────────
+# Output encoding — straight from the generated tensor
+# ──────────────────────────────────────────────────────────
+
+def _encode_wav(audio, sample_rate):
+    """Encode a (channels, samples) audio tensor as 16-bit PCM WAV bytes."""
+    samples = audio.detach().float().cpu().numpy()
+    if samples.ndim == 2:
+        samples = samples.T  # soundfile expects (frames, channels)
+    bio = io.BytesIO()
+    sf.write(bio, samples, sample_rate, format="WAV", subtype="PCM_16")
+    return bio.getvalue()
+
+
+def _output_wav_bytes(audio_info):
+    """WAV bytes for one generate_music output, or None if there is none.
+
+    Prefers the in-memory tensor; reads the saved file only when ACE-Step
+    did not return one.
+    """
+    audio = audio_info.get("tensor")
+    if audio is not None:
+        return _encode_wav(audio, audio_info.get("sample_rate", 48000))
+    path = audio_info.get("path", "")
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return None
+
+
+# ──────────────────────────────────────────────────────────
+# Job input — parsed and validated before any decode or disk I/O
+# ──────────────────────────────────────────────────────────
+
+_MAX_BATCH_SIZE = 8
+_DIGEST_CHUNK = 1024 * 1024  # chars hashed per update — bounds the temp copy
+
+
+def _parse_bool(value):
+    """JSON booleans, plus the usual string spellings ("false", "0", ...)."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "1", "yes"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+
+@dataclass
+class CoverJob:
+    """Validated cover-mode job input."""
+
+    reference_audio: str = field(repr=False)  # base64 WAV
+    prompt: str = ""
+    lyrics: str = "[Instrumental]"
+    audio_cover_strength: float = 0.5
+    inference_steps: int = 8
+    bpm: int | None = None
+    key_scale: str = ""
+    duration: float = 30.0
+    seed: int = -1
+    shift: float = 3.0
+    batch_size: int = 1
+    return_url: bool = True
+
+    def __post_init__(self):
+        for name in ("reference_audio", "prompt", "lyrics", "key_scale"):
+            if not isinstance(getattr(self, name), str):
+                raise ValueError(f"{name} must be a string")
+        if not self.reference_audio:
+            raise ValueError("reference_audio (base64) is required for cover mode")
+        if len(self.reference_audio) <= 100:
+            raise ValueError("reference_audio is too short to be audio")
+        if not 0.0 <= self.audio_cover_strength <= 1.0:
+            raise ValueError("audio_cover_strength must be between 0 and 1")
+        if not 10 <= self.duration <= 600:
+            raise ValueError("duration must be between 10 and 600 seconds")
+        if not 1 <= self.inference_steps <= 100:
+            raise ValueError("inference_steps must be between 1 and 100")
+        if not 1.0 <= self.shift <= 5.0:
+            raise ValueError("shift must be between 1.0 and 5.0")
+        if self.bpm is not None and not 30 <= self.bpm <= 300:
+            raise ValueError("bpm must be between 30 and 300")
+        if not 1 <= self.batch_size <= _MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {_MAX_BATCH_SIZE}")
+
+    @functools.cached_property
+    def ref_digest(self):
+        """blake2b of the base64 payload, hashed in chunks to avoid a full copy.
+
+        Only the micro-batcher reads this, so single-job workers never pay
+        for the hash.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        audio = self.reference_audio
+        for i in range(0, len(audio), _DIGEST_CHUNK):
+            h.update(audio[i:i + _DIGEST_CHUNK].encode())
+        return h.hexdigest()
+
+    @classmethod
+    def from_event(cls, input_data):
+        """Build from a RunPod job input dict. Raises ValueError on bad input."""
+        get = input_data.get
+        try:
+            bpm = get("bpm")
+            return cls(
+                reference_audio=get("reference_audio", ""),
+                prompt=get("prompt", ""),
+                lyrics=get("lyrics", "[Instrumental]"),
+                audio_cover_strength=float(get("audio_cover_strength", 0.5)),
+                inference_steps=int(get("inference_steps", 8)),
+                bpm=int(bpm) if bpm is not None else None,
+                key_scale=get("key_scale", ""),
+                duration=float(get("duration", 30)),
+                seed=int(get("seed", -1)),
+                shift=float(get("shift", 3.0)),
+                batch_size=int(get("batch_size", 1)),
+                return_url=_parse_bool(get("return_url", True)),
+            )
+        except (TypeError, OverflowError) as e:
+            raise ValueError(str(e)) from e
+
+
+# ──────────────────────────────────────────────────────────
+# Generation — direct, or micro-batched across concurrent jobs
+# ──────────────────────────────────────────────────────────
+
+_max_concurrency = int(os.environ.get("SOPHIA_MAX_CONCURRENCY", "1"))
+_max_batch = int(os.environ.get("SOPHIA_MAX_BATCH", "4"))
+_batch_wait = int(os.environ.get("SOPHIA_BATCH_WAIT_MS", "25")) / 1000
+_batch_queue = queue.Queue()
+
+# Inputs that must match for two jobs to share one generate_music call
+_BATCH_FIELDS = ("ref_digest", "prompt", "lyrics", "audio_cover_strength",
+                 "inference_steps", "bpm", "key_scale", "duration", "shift")
+
+
+def _generate(cover, ref_path, batch_size):
+    """Run one generate_music call. Returns (result, elapsed_seconds)."""
+    lyrics = cover.lyrics
+    params = GenerationParams(
+        task_type="cover",
+        reference_audio=ref_path,
+        audio_cover_strength=cover.audio_cover_strength,
+        caption=cover.prompt,
+        lyrics=lyrics,
+        instrumental=lyrics.strip().lower() in ("[instrumental]", "[inst]", ""),
+        bpm=cover.bpm,
+        keyscale=cover.key_scale,
+        duration=cover.duration,
+        inference_steps=cover.inference_steps,
+        seed=cover.seed,
+        shift=cover.shift,
+        thinking=False,
+        infer_method="ode",
+    )
+
+    config = GenerationConfig(
+        batch_size=batch_size,
+        audio_format="wav",
+        use_random_seed=(cover.seed == -1),
+    )
+
+    start_time = time.time()
+
+    with _gpu_lock:
+        if _offloaded:
+            _reload_dit()
+        with torch.inference_mode(), torch.autocast(
+                "cuda", dtype=_inference_dtype,
+                enabled=_inference_dtype != torch.float32):
+            result = generate_music(
+                dit_handler=_dit_handler,
+                llm_handler=_llm_handler,
+                params=params,
+                config=config,
+                save_dir=None,  # keep outputs in memory
+            )
+
+    return result, time.time() - start_time
+
+
+def _batch_key(cover):
+    """Jobs with equal keys can be merged into one larger batch.
+
+    Only random-seed jobs over identical inputs qualify — merging them just
+    asks ACE-Step for more variations. Fixed-seed jobs always run alone.
+    """
+    if cover.seed != -1:
+        return object()
+    return tuple(getattr(cover, name) for name in _BATCH_FIELDS)
+
+
+def _run_group(group):
+    """Generate once for a group of compatible jobs and fan out the outputs."""
+    first = group[0]
+    total = sum(item["cover"].batch_size for item in group)
+    if len(group) > 1:
+        print(f"[SOPHIA] Micro-batch: {len(group)} jobs, batch_size={total}", flush=True)
+    try:
+        result, elapsed = _generate(first["cover"], first["ref_path"], total)
+    except Exception as e:
+        for item in group:
+            item["reply"].put(e)
+        return
+
+    audios = result.audios or []
+    offset = 0
+    for item in group:
+        n = item["cover"].batch_size
+        item["reply"].put((result, audios[offset:offset + n], elapsed))
+        offset += n
+
+
+def _batcher():
+    """Collect up to _max_batch jobs within _batch_wait, then run them grouped."""
+    while True:
+        items = [_batch_queue.get()]
+        deadline = time.time() + _batch_wait
+        while len(items) < _max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(_batch_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        # Each group's summed batch_size stays within _MAX_BATCH_SIZE, the
+        # same VRAM bound a single job is held to
+        groups = {}
+        for item in items:
+            key = _batch_key(item["cover"])
+            group = groups.get(key)
+            if group is not None and (sum(i["cover"].batch_size for i in group)
+                                      + item["cover"].batch_size > _MAX_BATCH_SIZE):
+                _run_group(group)
+                group = None
+            if group is None:
+                group = groups[key] = []
+            group.append(item)
+        for group in groups.values():
+            _run_group(group)
+
+
+def _run_generation(cover, ref_path):
+    """Generate for one job. Returns (result, audios, elapsed_seconds).
+
+    Goes through the micro-batcher only when jobs can actually arrive
+    concurrently; otherwise calls generate_music directly.
+    """
+    if _max_concurrency <= 1:
+        result, elapsed = _generate(cover, ref_path, cover.batch_size)
+        return result, result.audios or [], elapsed
+
+    reply = queue.Queue(maxsize=1)
+    _batch_queue.put({"cover": cover, "ref_path": ref_path, "reply": reply})
+    out = reply.get()
+    if isinstance(out, Exception):
+        raise out
+    return out
+
+
 # ──────────────────────────────────────────────────────────
 # Handler — called per job
 # ──────────────────────────────────────────────────────────
 
 def handler(job):
     """RunPod serverless handler for ACE-Step 1.5 cover mode generation."""
+    global _last_job_ts, _pool_trimmed
     input_data = job["input"]
 
     # ── Echo/ping mode — test queue connectivity ──
@@ -129,123 +1148,154 @@ def handler(job):
             "version": "v7",
         }
 
+    # ── Validate before loading the model or touching disk ──
+    try:
+        cover = CoverJob.from_event(input_data)
+    except ValueError as e:
+        return {"error": f"Invalid input: {e}"}
+
+    # ── Shared weights are only valid while their leader lives ──
+    if _leader_pid is not None:
+        _drop_orphaned_weights()
+
     # ── Load model on first real job ──
     if not _model_loaded:
-        print("[SOPHIA] First real job — loading model...", flush=True)
+        print("[SOPHIA] First real job — loading model (or awaiting pre-load)...", flush=True)
         ok, err = _load_model()
         if not ok:
             return {"error": f"Model failed to load: {err}"}
 
-    # ── Extract parameters ──
-    reference_audio_b64 = input_data.get("reference_audio", "")
-    prompt = input_data.get("prompt", "")
-    lyrics = input_data.get("lyrics", "[Instrumental]")
-    audio_cover_strength = float(input_data.get("audio_cover_strength", 0.5))
-    inference_steps = int(input_data.get("inference_steps", 8))
-    bpm = input_data.get("bpm")
-    if bpm is not None:
-        bpm = int(bpm)
-    key_scale = input_data.get("key_scale", "")
-    duration = float(input_data.get("duration", 30))
-    seed = int(input_data.get("seed", -1))
-    shift = float(input_data.get("shift", 3.0))
-    batch_size = int(input_data.get("batch_size", 1))
-
-    if not reference_audio_b64:
-        return {"error": "reference_audio (base64) is required for cover mode"}
-
-    # ── Write reference audio to temp file ──
-    ref_path = os.path.join(tempfile.gettempdir(), "sophia_ref_input.wav")
-    with open(ref_path, "wb") as f:
-        f.write(base64.b64decode(reference_audio_b64))
+    # ── Write reference audio to a per-job temp file ──
+    try:
+        ref_path = _write_reference(cover.reference_audio)
+    except binascii.Error as e:
+        return {"error": f"Invalid input: reference_audio is not valid base64 ({e})"}
 
     file_size = os.path.getsize(ref_path)
-    print(f"[SOPHIA] Job received: strength={audio_cover_strength} "
-          f"steps={inference_steps} bpm={bpm} key={key_scale} "
-          f"duration={duration}s ref_size={file_size}B", flush=True)
+    print(f"[SOPHIA] Job received: strength={cover.audio_cover_strength} "
+          f"steps={cover.inference_steps} bpm={cover.bpm} key={cover.key_scale} "
+          f"duration={cover.duration}s ref_size={file_size}B", flush=True)
 
     try:
-        from acestep.inference import GenerationParams, GenerationConfig, generate_music
-
-        params = GenerationParams(
-            task_type="cover",
-            reference_audio=ref_path,
-            audio_cover_strength=audio_cover_strength,
-            caption=prompt,
-            lyrics=lyrics,
-            instrumental=lyrics.strip().lower() in ("[instrumental]", "[inst]", ""),
-            bpm=bpm,
-            keyscale=key_scale,
-            duration=duration,
-            inference_steps=inference_steps,
-            seed=seed,
-            shift=shift,
-            thinking=False,
-            infer_method="ode",
-        )
-
-        config = GenerationConfig(
-            batch_size=batch_size,
-            audio_format="wav",
-            use_random_seed=(seed == -1),
-        )
-
-        save_dir = tempfile.mkdtemp(prefix="sophia_runpod_")
-        start_time = time.time()
-
-        result = generate_music(
-            dit_handler=_dit_handler,
-            llm_handler=_llm_handler,
-            params=params,
-            config=config,
-            save_dir=save_dir,
-        )
-
-        elapsed = time.time() - start_time
+        result, audios, elapsed = _run_generation(cover, ref_path)
         print(f"[SOPHIA] Generation done in {elapsed:.1f}s", flush=True)
 
         if not result.success:
             return {"error": f"Generation failed: {result.error}"}
 
-        if not result.audios:
+        if not audios:
             return {"error": "Generation produced no audio outputs"}
 
-        # ── Return first result as base64 ──
-        audio_info = result.audios[0]
-        audio_path = audio_info.get("path", "")
+        # ── Return first result ──
+        audio_info = audios[0]
+        wav_bytes = _output_wav_bytes(audio_info)
 
-        if not audio_path or not os.path.exists(audio_path):
-            return {"error": f"Output audio not found at: {audio_path}"}
+        if wav_bytes is None:
+            return {"error": f"Output audio not found at: {audio_info.get('path', '')}"}
 
-        with open(audio_path, "rb") as f:
-            audio_b64 = base64.b64encode(f.read()).decode()
-
-        output_size = os.path.getsize(audio_path)
+        output_size = len(wav_bytes)
         print(f"[SOPHIA] Output: {output_size} bytes, {elapsed:.1f}s", flush=True)
 
-        return {
-            "audio_b64": audio_b64,
+        response = {
             "format": "wav",
-            "duration": duration,
-            "seed": seed,
+            "duration": cover.duration,
+            "seed": cover.seed,
             "inference_time": round(elapsed, 2),
         }
 
+        # ── Large outputs go to object storage; small ones stay inline ──
+        if (_s3 is not None and cover.return_url
+                and output_size >= _inline_max_bytes):
+            try:
+                response["audio_url"] = _upload_output(wav_bytes, job.get("id"))
+                return response
+            except Exception as ue:
+                print(f"[SOPHIA] Upload failed, falling back to base64: {ue}", flush=True)
+
+        response["audio_b64"] = pybase64.b64encode_as_string(wav_bytes)
+        return response
+
     except Exception as e:
-        traceback.print_exc()
+        logger.error("handler failure", exc_info=True,
+                     extra={"job_id": job.get("id"), "phase": "inference"})
         return {"error": f"Inference error: {str(e)}"}
 
     finally:
+        _last_job_ts = time.time()
+        _job_history.append(_last_job_ts)
+        _pool_trimmed = False
         try:
             os.unlink(ref_path)
         except OSError:
             pass
 
 
+async def _async_handler(job):
+    """Run the blocking handler off the event loop so concurrent jobs overlap."""
+    return await asyncio.to_thread(handler, job)
+
+
 # ──────────────────────────────────────────────────────────
-# Entry point — register immediately, no pre-loading
+# Entry point — register immediately, pre-load in background
 # ──────────────────────────────────────────────────────────
 
-print("[SOPHIA] v7 handler starting...", flush=True)
-print("[SOPHIA] Registering with RunPod queue (no pre-load)...", flush=True)
-runpod.serverless.start({"handler": handler})
+def _start_mps():
+    """Start the NVIDIA MPS control daemon so handler processes share one context.
+
+    Must run before any CUDA initialisation. Skipped if another worker in
+    the container already started it.
+    """
+    pipe_dir = os.environ.setdefault("CUDA_MPS_PIPE_DIRECTORY", "/tmp/nvidia-mps")
+    log_dir = os.environ.setdefault("CUDA_MPS_LOG_DIRECTORY", "/tmp/nvidia-log")
+    if os.path.exists(os.path.join(pipe_dir, "control")):
+        print("[SOPHIA] MPS daemon already running", flush=True)
+        return
+    os.makedirs(pipe_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+    try:
+        subprocess.run(["nvidia-cuda-mps-control", "-d"], check=True)
+        print(f"[SOPHIA] MPS daemon started (pipe={pipe_dir})", flush=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[SOPHIA] MPS unavailable, continuing without it: {e}", flush=True)
+
+
+def _background_preload():
+    """Load the model opportunistically while the worker sits idle."""
+    time.sleep(2)  # let queue registration settle first
+    print("[SOPHIA] Background model pre-load starting...", flush=True)
+    ok, err = _load_model()
+    if not ok:
+        print(f"[SOPHIA] Background pre-load failed (will retry on first job): {err}",
+              flush=True)
+
+
+def _fake_forward():
+    """Tiny CPU forward pass run at image build (see prewarm.py).
+
+    Exercises torch's lazy imports and CPU kernel dispatch so their
+    bytecode and shared libraries are resolved inside the image layer.
+    """
+    layer = torch.nn.Linear(8, 8)
+    with torch.inference_mode():
+        layer(torch.zeros(1, 8))
+
+
+if __name__ == "__main__":
+    print("[SOPHIA] v7 handler starting...", flush=True)
+    if os.environ.get("SOPHIA_ENABLE_MPS", "0") == "1":
+        _start_mps()
+    print("[SOPHIA] Registering with RunPod queue (background pre-load)...", flush=True)
+    _start_weight_warmup()
+    threading.Thread(target=_background_preload, name="sophia-preload", daemon=True).start()
+    threading.Thread(target=_idle_watcher, name="sophia-idle", daemon=True).start()
+
+    if _max_concurrency > 1:
+        print(f"[SOPHIA] Concurrency {_max_concurrency}, micro-batch up to {_max_batch} "
+              f"within {_batch_wait * 1000:.0f}ms", flush=True)
+        threading.Thread(target=_batcher, name="sophia-batcher", daemon=True).start()
+        runpod.serverless.start({
+            "handler": _async_handler,
+            "concurrency_modifier": lambda current: _max_concurrency,
+        })
+    else:
+        runpod.serverless.start({"handler": handler})
@@ -0,0 +1,13 @@
+"""Build-time warm-up for the Sophia RunPod image.
+
+Imports the handler (and with it torch + ACE-Step) and runs a tiny CPU
+forward pass, so bytecode caches and dynamic-linker resolution are baked
+into the image layer instead of being paid on the first job.
+
+Invoked from the Dockerfile when PREWARM=1.
+"""
+
+import handler
+
+handler._fake_forward()
+print("Prewarm complete")